@@ -1,5 +1,5 @@
 from .augmentor_base import Augmentor
-from .extract_env import extract_env, find_central_atom
+from .extract_env import build_neighbors, extract_env, find_central_atom
 from .factory import AugmentorBuilder, augmentor_factory, augmentor_builder
 # from .kim import KIMAugmentor
 
@@ -8,6 +8,7 @@ __all__ = [
     'AugmentorBuilder',
     'augmentor_factory',
     'augmentor_builder',
+    'build_neighbors',
     'extract_env',
     'find_central_atom',
 ]
@@ -0,0 +1,77 @@
+import numpy as np
+from functools import lru_cache
+
+# replaced by numba.prange when the kernel is compiled, see
+# get_filter_neighbors
+prange = range
+
+
+def _filter_neighbors(
+    pos: np.ndarray,
+    center: np.ndarray,
+    neigh_inds: np.ndarray,
+    offsets: np.ndarray,
+    cell: np.ndarray,
+    half: float,
+    rc2: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute neighbor displacements and the cube/sphere masks in one pass
+
+    Fused version of the displacement and masking steps of extract_env, which
+    avoids allocating the intermediate arrays of the NumPy implementation.
+    The displacements are accumulated in the same order as the NumPy path
+    (position + (offsets @ cell) - center), and fastmath is not used, so atoms
+    on the cube or sphere boundary are treated the same by both paths.
+
+    Use :func:`get_filter_neighbors` to obtain the compiled kernel.
+
+    :param pos: (N, 3) positions of all atoms in the original configuration
+    :param center: (3,) position of the central atom
+    :param neigh_inds: (M,) indices of the neighbors of the central atom
+    :param offsets: (M, 3) integer cell offsets of the neighbors
+    :param cell: (3, 3) cell of the original configuration
+    :param half: half of the side length of the extracted cube
+    :param rc2: squared cutoff radius of the extracted sphere
+    :returns: tuple of the (M, 3) neighbor displacements, the (M,) mask of
+        neighbors within the cube, and the (M,) mask of neighbors within both
+        the cube and the sphere
+    """
+    n_neigh = neigh_inds.shape[0]
+    disp = np.empty((n_neigh, 3))
+    in_cube = np.empty(n_neigh, dtype=np.bool_)
+    in_sphere = np.empty(n_neigh, dtype=np.bool_)
+    for k in prange(n_neigh):
+        j = neigh_inds[k]
+        cube_ok = True
+        d2 = 0.0
+        for x in range(3):
+            shift = (offsets[k, 0] * cell[0, x] + offsets[k, 1] * cell[1, x]
+                     + offsets[k, 2] * cell[2, x])
+            d = pos[j, x] + shift - center[x]
+            disp[k, x] = d
+            cube_ok = cube_ok and abs(d) <= half
+            d2 += d * d
+        in_cube[k] = cube_ok
+        in_sphere[k] = cube_ok and d2 <= rc2
+    return disp, in_cube, in_sphere
+
+
+@lru_cache(maxsize=None)
+def get_filter_neighbors():
+    """
+    Compile the neighbor filtering kernel with numba on first use
+
+    numba is only imported here, so importing the augmentor does not pay for
+    it unless the kernel is actually needed. The integer inputs of the kernel
+    should be cast to int64 so that it is only compiled once.
+
+    :returns: the compiled kernel, or None if numba is not installed
+    """
+    global prange
+    try:
+        import numba
+    except ImportError:
+        return None
+    prange = numba.prange
+    return numba.njit(parallel=True, cache=True)(_filter_neighbors)
@@ -1,9 +1,23 @@
 import numpy as np
+from itertools import product
 from ase import Atoms
-from ase.neighborlist import NeighborList
+from ase.constraints import FixAtoms
 from typing import Optional
 from orchestrator.utils.exceptions import CellTooSmallError
 from orchestrator.utils.data_standard import METADATA_KEY
+from ._extract_env_kernels import get_filter_neighbors
+
+try:
+    from matscipy.neighbours import neighbour_list
+except ImportError:
+    from ase.neighborlist import neighbor_list as neighbour_list
+
+# below this many central atoms, neighbors are found by brute force instead of
+# building a NeighborList over the full configuration
+DIRECT_NEIGHBOR_THRESHOLD = 32
+# above this many neighbors, the numba kernel is used to filter them (if numba
+# is installed)
+NUMBA_NEIGHBOR_THRESHOLD = 512
 
 
 def extract_env(
@@ -13,6 +27,7 @@ def extract_env(
     new_cell: np.ndarray,
     extract_cube: Optional[bool] = False,
     keys_to_transfer: Optional[list[str]] = None,
+    neighbors: Optional[list[tuple[np.ndarray, np.ndarray]]] = None,
 ) -> list[Atoms]:
     """
     function for extracting local environments
@@ -34,13 +49,21 @@ def extract_env(
         currently performed)
     :param keys_to_transfer: list of array keys which contain additional data
         that should be attached to the new configurations
+    :param neighbors: precomputed neighbor lists of original_atoms from
+        :func:`build_neighbors`. They must be built with a cutoff of at least
+        the half diagonal of new_cell (sqrt(3)/2 times its side length),
+        otherwise atoms near the corners of the cube are silently missed.
+        Pass these to reuse the lists across repeated calls on the same
+        configuration. If None, neighbors are found internally and discarded
+        when the function returns
     :returns: list of ase atoms objects with the local environment emedded
     """
     if new_cell.size == 3:
         cell_norms = new_cell
         max_cell_len = np.max(new_cell)
     else:
-        if ~(new_cell[np.where(~np.eye(new_cell.shape[0], dtype=bool))] == 0):
+        off_diag_mask = ~np.eye(new_cell.shape[0], dtype=bool)
+        if not np.all(new_cell[off_diag_mask] == 0):
             raise ValueError('New cell is non orthorhombic; this is an '
                              'unxpected case not accounted for')
 
@@ -50,12 +73,12 @@ def extract_env(
         keys_to_transfer = []
 
     # initial checks
-    if ~(cell_norms[0] == cell_norms[1] == cell_norms[2]):
+    if not (cell_norms[0] == cell_norms[1] == cell_norms[2]):
         raise ValueError('New cell is not a cube. This is an unxpected case '
                          'not accounted for')
-    if (max_cell_len > original_atoms.cell.cellpar()[0]
-            or max_cell_len > original_atoms.cell.cellpar()[1]
-            or max_cell_len > original_atoms.cell.cellpar()[2]):
+    cellpar = original_atoms.cell.cellpar()
+    if (max_cell_len > cellpar[0] or max_cell_len > cellpar[1]
+            or max_cell_len > cellpar[2]):
         raise CellTooSmallError(
             'Requested extracted cell size is larger than original structure')
     if max_cell_len < rc:
@@ -67,89 +90,97 @@ def extract_env(
                                 'length')
     if isinstance(atom_inds, int):
         atom_inds = [atom_inds]
+    if neighbors is not None and len(neighbors) != len(original_atoms):
+        raise ValueError(f'Got neighbor lists for {len(neighbors)} atoms but '
+                         f'the configuration has {len(original_atoms)}; '
+                         'they must be built from original_atoms')
+
+    # fetch everything needed from the Atoms object once, outside the loop
+    pos = original_atoms.get_positions()
+    cell = np.asarray(original_atoms.get_cell())
+    symbols = np.asarray(original_atoms.get_chemical_symbols())
+    key_arrays = {
+        k: original_atoms.get_array(k, copy=False)
+        for k in keys_to_transfer
+    }
+    box_center = cell_norms / 2
+    # check info dict for any keys related to the keys_to_transfer, this is
+    # the same for all subcells so only needs to be done once
+    new_info_dict = {}
+    new_metadata_dict = {}
+    for output_key in [x.rsplit('_', 1)[0] for x in keys_to_transfer]:
+        for info_key in original_atoms.info:
+            if output_key in info_key:
+                new_info_dict[info_key] = original_atoms.info[info_key]
+        if output_key in original_atoms.info[METADATA_KEY]:
+            new_metadata_dict[output_key] = original_atoms.info[METADATA_KEY][
+                output_key]
 
     # get neighboring atom pos displacements
-    n_atoms = original_atoms.get_positions().shape[0]
-    # cuttoff for each atom, uses overlapping spheres of rc, so only need 1/2
-    # length, see docs
-    cutoffs = (0.5 * max_cell_len * np.ones((n_atoms))).tolist()
-    nl = NeighborList(cutoffs, self_interaction=True, bothways=True)
-    nl.update(original_atoms)
+    # the extracted cube is fully contained within a sphere of radius equal to
+    # its half diagonal around the central atom. Pad it slightly so atoms on
+    # the cube corners survive strict comparisons in the neighbor backends
+    neigh_cutoff = np.sqrt(3) / 2 * max_cell_len + 1e-6
+    use_direct = (neighbors is None
+                  and len(atom_inds) < DIRECT_NEIGHBOR_THRESHOLD)
+    if neighbors is None and not use_direct:
+        neighbors = build_neighbors(original_atoms, neigh_cutoff)
     subcells = []
-    key_arrays = {k: original_atoms.get_array(k) for k in keys_to_transfer}
 
     for atom_ind in atom_inds:
-        indices, offsets = nl.get_neighbors(atom_ind)
-        neigh_disp = np.zeros((offsets.shape[0], 3))
-        neigh_symbols = []
-        neigh_arrays = {k: [] for k in keys_to_transfer}
-        neigh_ind = 0
-        for i, offset in zip(indices, offsets):
-            neigh_disp[neigh_ind, :] = (original_atoms.positions[i]
-                                        + offset @ original_atoms.get_cell()
-                                        ) - original_atoms.positions[atom_ind]
-            neigh_symbols.append(original_atoms.symbols[i])
-            for key in keys_to_transfer:
-                neigh_arrays[key].append(key_arrays[key][i])
-            neigh_ind += 1
-
-        # find atoms in cube
-        ind_in_cube = np.where(
-            np.all(np.abs(neigh_disp) <= (max_cell_len / 2), 1))[0]
-        cube_disp = neigh_disp[ind_in_cube, :]
-        cube_symbols = []
-        cube_arrays = {k: [] for k in keys_to_transfer}
-        for i in ind_in_cube:
-            cube_symbols.append(neigh_symbols[int(i)])
-            for key in keys_to_transfer:
-                cube_arrays[key].append(neigh_arrays[key][int(i)])
-
-        # find atoms within rc
-        ind_in_rc = np.where(np.linalg.norm(cube_disp, 2, 1) <= rc)[0]
-        sphere_disp = cube_disp[ind_in_rc, :]
-        sphere_symbols = []
-        sphere_arrays = {k: [] for k in keys_to_transfer}
-        for i in ind_in_rc:
-            sphere_symbols.append(cube_symbols[int(i)])
-            for key in keys_to_transfer:
-                sphere_arrays[key].append(cube_arrays[key][int(i)])
+        if use_direct:
+            indices, offsets = _get_neighbors_direct(original_atoms, atom_ind,
+                                                     neigh_cutoff)
+        else:
+            indices, offsets = neighbors[atom_ind]
+        filter_neighbors = None
+        if len(indices) > NUMBA_NEIGHBOR_THRESHOLD:
+            filter_neighbors = get_filter_neighbors()
+        if filter_neighbors is not None:
+            # fused kernel computing displacements and masks in one pass.
+            # Backends return different integer types, cast them so the
+            # kernel is only compiled once
+            neigh_disp, in_cube, in_sphere = filter_neighbors(
+                pos, pos[atom_ind], indices.astype(np.int64, copy=False),
+                offsets.astype(np.int64, copy=False), cell, max_cell_len / 2,
+                rc * rc)
+        else:
+            # gather all neighbors at once rather than looping over them
+            neigh_disp = pos[indices] + offsets @ cell - pos[atom_ind]
+            # find atoms in cube and within rc in a single pass
+            in_cube = np.all(np.abs(neigh_disp) <= (max_cell_len / 2), 1)
+            dist2 = np.einsum('ij,ij->i', neigh_disp, neigh_disp)
+            in_sphere = dist2 <= rc * rc
+            in_sphere &= in_cube
 
         # make new atoms object
+        kept = np.flatnonzero(in_cube if extract_cube else in_sphere)
+        # neighbor order differs between search paths, so sort the kept atoms
+        # to make the subcell independent of which path was used
+        kept = kept[_canonical_order(atom_ind, indices[kept], offsets[kept])]
         if extract_cube:
-            new_pos = cube_disp
-            new_symbols = cube_symbols
-            ind_fix = ind_in_rc
-            new_arrays = cube_arrays
+            # constrain the atoms in rc, indexed relative to the cube
+            ind_fix = np.flatnonzero(in_sphere[kept])
         else:
-            new_pos = sphere_disp
-            new_symbols = sphere_symbols
-            ind_fix = np.arange(new_pos.shape[0], dtype=int)
-            new_arrays = sphere_arrays
-
-        box_center = cell_norms / 2
-        new_pos = new_pos + box_center
+            ind_fix = np.arange(len(kept), dtype=int)
+        # the gather is a new array, so center it in place
+        new_pos = neigh_disp[kept]
+        new_pos += box_center
+        # only gather per-atom data for the neighbors which are kept
+        new_inds = indices[kept]
+        new_symbols = symbols[new_inds]
+        new_arrays = {k: v[new_inds] for k, v in key_arrays.items()}
 
         new_atoms = Atoms(symbols=new_symbols,
                           positions=new_pos,
                           cell=new_cell,
                           pbc=True)
         for key, arr in new_arrays.items():
-            # data was saved as list of 1d arrays convert to 2D
-            new_atoms.set_array(key, np.array(arr))
-        # check info dict for any keys related to the keys_to_transfer
-        new_info_dict = {}
-        new_metadata_dict = {}
-        for output_key in [x.rsplit('_', 1)[0] for x in keys_to_transfer]:
-            for info_key in original_atoms.info:
-                if output_key in info_key:
-                    new_info_dict[info_key] = original_atoms.info[info_key]
-            if output_key in original_atoms.info[METADATA_KEY]:
-                new_metadata_dict[output_key] = original_atoms.info[
-                    METADATA_KEY][output_key]
-        new_atoms.info = new_info_dict
-        new_atoms.info[METADATA_KEY] = new_metadata_dict
+            new_atoms.set_array(key, arr)
+        # each subcell gets its own copy of the transferred info
+        new_atoms.info = dict(new_info_dict)
+        new_atoms.info[METADATA_KEY] = dict(new_metadata_dict)
         # add constraint
-        from ase.constraints import FixAtoms
         c = FixAtoms(indices=ind_fix)
         new_atoms.set_constraint(c)
 
@@ -158,6 +189,106 @@ def extract_env(
     return subcells
 
 
+def build_neighbors(
+    atoms: Atoms,
+    cutoff: float,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Build the neighbor lists of all atoms in a configuration
+
+    Uses matscipy if it is installed and falls back to ase's neighbor_list
+    function otherwise, both of which are considerably faster than ase's
+    NeighborList class. The result can be passed to :func:`extract_env` to
+    reuse it across repeated calls on the same configuration.
+
+    :param atoms: configuration to build the neighbor lists for
+    :param cutoff: distance within which neighbors are returned
+    :returns: list with the neighbor indices and integer cell offsets of each
+        atom, following the convention of ase's NeighborList.get_neighbors().
+        Each atom is included as its own neighbor. Neighbors are in no
+        particular order; extract_env sorts the atoms it keeps
+    """
+    n_atoms = len(atoms)
+    i, j, shifts = neighbour_list('ijS', atoms, cutoff)
+    # pairs are grouped per atom below, which requires them sorted by i. ase
+    # guarantees this but matscipy does not document it, so check first
+    if not np.all(np.diff(i) >= 0):
+        order = np.argsort(i, kind='stable')
+        i, j, shifts = i[order], j[order], shifts[order]
+    # add the self interaction of each atom, which neither backend includes,
+    # at the start of each atom's block
+    counts = np.bincount(i, minlength=n_atoms)
+    starts = np.cumsum(counts) - counts
+    j = np.insert(j, starts, np.arange(n_atoms))
+    shifts = np.insert(shifts, starts, 0, axis=0)
+
+    split_inds = np.cumsum(counts + 1)[:-1]
+    return list(zip(np.split(j, split_inds), np.split(shifts, split_inds)))
+
+
+def _get_neighbors_direct(
+    atoms: Atoms,
+    atom_ind: int,
+    cutoff: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find all atoms (and periodic images) within cutoff of a single atom
+
+    Brute force alternative to a NeighborList which only considers one central
+    atom, so it is cheaper when environments of only a few atoms are needed.
+
+    :param atoms: configuration containing the central atom
+    :param atom_ind: index of the central atom
+    :param cutoff: distance within which neighbors are returned, the central
+        atom itself is included
+    :returns: tuple of neighbor indices and integer cell offsets, following
+        the convention of ase's NeighborList.get_neighbors(), in no particular
+        order
+    """
+    cell = atoms.cell
+    pbc = atoms.pbc
+    frac = cell.scaled_positions(atoms.positions - atoms.positions[atom_ind])
+    # minimum image in fractional coordinates along the periodic directions
+    base_offsets = np.where(pbc, -np.round(frac), 0).astype(int)
+    frac = frac + base_offsets
+    # number of images needed along each direction to cover the cutoff,
+    # determined by the spacing between lattice planes
+    plane_spacing = 1 / np.linalg.norm(cell.reciprocal(), axis=1)
+    n_images = np.where(pbc, np.floor(cutoff / plane_spacing + 0.5), 0)
+
+    indices = []
+    offsets = []
+    for shift in product(*[range(-n, n + 1) for n in n_images.astype(int)]):
+        disp = (frac + shift) @ cell.array
+        dist2 = np.einsum('ij,ij->i', disp, disp)
+        close = np.flatnonzero(dist2 <= cutoff * cutoff)
+        indices.append(close)
+        offsets.append(base_offsets[close] + shift)
+
+    return np.concatenate(indices), np.concatenate(offsets)
+
+
+def _canonical_order(
+    atom_ind: int,
+    indices: np.ndarray,
+    offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Order neighbors of an atom independently of how they were found
+
+    The central atom itself comes first, followed by all other neighbors
+    sorted by index and then by cell offset.
+
+    :param atom_ind: index of the central atom
+    :param indices: (M,) indices of the neighbors
+    :param offsets: (M, 3) integer cell offsets of the neighbors
+    :returns: (M,) array of positions which sort the neighbors
+    """
+    not_self = (indices != atom_ind) | np.any(offsets != 0, axis=1)
+    return np.lexsort(
+        (offsets[:, 2], offsets[:, 1], offsets[:, 0], indices, not_self))
+
+
 def find_central_atom(config: Atoms, side_size: float) -> int:
     """
     Find the central atom index in an extracted environment
@@ -172,13 +303,8 @@ def find_central_atom(config: Atoms, side_size: float) -> int:
     :returns: index of the central atom in the Atoms object
     """
     half_length = side_size / 2
-    atom_found = False
-    for i, atom_pos in enumerate(config.positions):
-        for coord in atom_pos:
-            if coord == half_length:
-                atom_found = True
-            else:
-                atom_found = False
-                break
-        if atom_found:
-            return i
+    # compare with a tolerance rather than relying on exact float identity
+    at_center = np.all(np.isclose(config.positions, half_length), axis=1)
+    hits = np.flatnonzero(at_center)
+    if hits.size > 0:
+        return int(hits[0])
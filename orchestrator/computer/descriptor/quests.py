@@ -7,6 +7,9 @@ from typing import Optional, Union, Any
 
 from quests.descriptor import get_descriptors
 
+# number of configurations passed to each get_descriptors call
+QUESTS_CHUNK_SIZE = 16
+
 
 class QUESTSDescriptor(AtomCenteredDescriptor):
     """
@@ -78,24 +81,30 @@ class QUESTSDescriptor(AtomCenteredDescriptor):
             (2*num_nearest_neighbors)-1
         :rtype: list
         """
+        # NOTE: these are being attached here because ColabFit can't do
+        # nested key extraction. e.g. extracting "cut_name" from
+        # atoms.info[METADATA_KEY][self.OUTPUT_KEY]['cut_name']
+        info_patch = {
+            f'{self.OUTPUT_KEY}_{k}': v
+            for k, v in self._metadata.items()
+        }
         for atoms in list_of_atoms:
-            # NOTE: these are being attached here because ColabFit can't do
-            # nested key extraction. e.g. extracting "cut_name" from
-            # atoms.info[METADATA_KEY][self.OUTPUT_KEY]['cut_name']
-            for k, v in self._metadata.items():
-                atoms.info[f'{self.OUTPUT_KEY}_{k}'] = v
-
+            atoms.info.update(info_patch)
             # to avoid overwriting if METADATA_KEY already exists
-            if METADATA_KEY not in atoms.info:
-                atoms.info[METADATA_KEY] = {}
-
-            atoms.info[METADATA_KEY][self.OUTPUT_KEY] = self._metadata
-
-        results = [
-            get_descriptors([atoms],
-                            k=self.num_nearest_neighbors,
-                            cutoff=self.cutoff) for atoms in list_of_atoms
-        ]
+            metadata = atoms.info.setdefault(METADATA_KEY, {})
+            metadata[self.OUTPUT_KEY] = self._metadata
+
+        # get_descriptors concatenates (and copies) the descriptors of all
+        # configurations passed to it, so call it on fixed size chunks to
+        # bound the peak memory
+        results = []
+        for start in range(0, len(list_of_atoms), QUESTS_CHUNK_SIZE):
+            chunk = list_of_atoms[start:start + QUESTS_CHUNK_SIZE]
+            descriptors = get_descriptors(chunk,
+                                          k=self.num_nearest_neighbors,
+                                          cutoff=self.cutoff)
+            split_inds = np.cumsum([len(atoms) for atoms in chunk])[:-1]
+            results.extend(np.split(descriptors, split_inds))
         return results
 
     def get_colabfit_property_definition(
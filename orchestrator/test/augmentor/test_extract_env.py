@@ -0,0 +1,138 @@
+import importlib
+import numpy as np
+from itertools import product
+import pytest
+from ase.build import bulk
+from ase.neighborlist import neighbor_list
+
+from orchestrator.augmentor import extract_env, find_central_atom
+from orchestrator.utils.data_standard import METADATA_KEY
+
+# the package re-exports the extract_env function under the module's name
+extract_env_module = importlib.import_module(
+    'orchestrator.augmentor.extract_env')
+
+SIDE = 11.0
+RC = 4.0
+ATOM_INDS = [0, 5, 17, 42]
+
+
+def _rattled_cell(skewed):
+    """
+    Build a rattled two species bulk cell with some data attached to transfer
+
+    :param skewed: if True, shear the cell to make it triclinic
+    :type skewed: bool
+    :returns: the configuration to extract environments from
+    :rtype: Atoms
+    """
+    atoms = bulk('Cu', 'fcc', a=3.6, cubic=True).repeat((4, 5, 6))
+    if skewed:
+        cell = atoms.cell.array.copy()
+        cell[1] += 0.3 * cell[0]
+        cell[2] += 0.2 * cell[1]
+        atoms.set_cell(cell, scale_atoms=True)
+    atoms.symbols[::3] = 'Ni'
+    atoms.rattle(0.05, seed=0)
+    rng = np.random.default_rng(0)
+    atoms.set_array('test_descriptors', rng.normal(size=(len(atoms), 4)))
+    atoms.info[METADATA_KEY] = {}
+    return atoms
+
+
+def _subcell_data(subcell):
+    """
+    Collect the contents of a subcell which should not depend on the path
+
+    :param subcell: extracted environment
+    :type subcell: Atoms
+    :returns: positions, symbols, transferred array and fixed mask
+    :rtype: tuple
+    """
+    fixed = np.zeros(len(subcell), dtype=bool)
+    fixed[subcell.constraints[0].index] = True
+    return (subcell.positions, subcell.symbols,
+            subcell.get_array('test_descriptors'), fixed)
+
+
+def _reference_neighbors(atoms):
+    """
+    Brute force neighbor lists of the tested atoms, built independently of
+    extract_env with a generous cutoff
+
+    :param atoms: configuration to build the neighbor lists for
+    :type atoms: Atoms
+    :returns: (indices, offsets) of the neighbors of each atom, empty for atoms
+        which are not extracted
+    :rtype: list
+    """
+    shifts = np.array(list(product(range(-2, 3), repeat=3)))
+    images = (atoms.positions[None, :, :]
+              + (shifts @ atoms.cell.array)[:, None, :])
+    neighbors = [(np.empty(0, dtype=int), np.empty((0, 3), dtype=int))
+                 for _ in range(len(atoms))]
+    for atom_ind in ATOM_INDS:
+        dist = np.linalg.norm(images - atoms.positions[atom_ind], axis=2)
+        shift_inds, indices = np.nonzero(dist <= SIDE)
+        neighbors[atom_ind] = (indices, shifts[shift_inds])
+    return neighbors
+
+
+def _extract(atoms, extract_cube, neighbors=None):
+    return extract_env(atoms,
+                       RC,
+                       ATOM_INDS,
+                       np.array([SIDE, SIDE, SIDE]),
+                       extract_cube=extract_cube,
+                       keys_to_transfer=['test_descriptors'],
+                       neighbors=neighbors)
+
+
+@pytest.mark.parametrize('path', ['direct', 'neighbor_list', 'ase', 'numba'])
+@pytest.mark.parametrize('extract_cube', [False, True])
+@pytest.mark.parametrize('skewed', [False, True])
+def test_extract_env_paths_agree(monkeypatch, path, extract_cube, skewed):
+    """
+    Tests that all neighbor search paths of extract_env give the same
+    environments, in the same atom order, as neighbor lists built
+    independently with a generous cutoff.
+
+    :param path: neighbor search path compared against the brute force one
+    :type path: str
+    :param extract_cube: passed to extract_env
+    :type extract_cube: bool
+    :param skewed: use a triclinic instead of a cubic cell
+    :type skewed: bool
+    """
+    atoms = _rattled_cell(skewed)
+
+    with monkeypatch.context() as m:
+        m.setattr(extract_env_module, 'get_filter_neighbors', lambda: None)
+        reference = _extract(atoms, extract_cube, _reference_neighbors(atoms))
+
+    threshold = 10**9 if path == 'direct' else 0
+    monkeypatch.setattr(extract_env_module, 'DIRECT_NEIGHBOR_THRESHOLD',
+                        threshold)
+    if path == 'ase':
+        monkeypatch.setattr(extract_env_module, 'neighbour_list',
+                            neighbor_list)
+    if path == 'numba':
+        pytest.importorskip('numba')
+        monkeypatch.setattr(extract_env_module, 'NUMBA_NEIGHBOR_THRESHOLD', 0)
+    else:
+        monkeypatch.setattr(extract_env_module, 'get_filter_neighbors',
+                            lambda: None)
+    subcells = _extract(atoms, extract_cube)
+
+    assert len(subcells) == len(reference)
+    for subcell, ref_subcell in zip(subcells, reference):
+        assert len(subcell) == len(ref_subcell)
+        # atom order should also be the same, not only the set of atoms
+        pos, symbols, arr, fixed = _subcell_data(subcell)
+        ref_pos, ref_symbols, ref_arr, ref_fixed = _subcell_data(ref_subcell)
+        np.testing.assert_allclose(pos, ref_pos, atol=1e-10)
+        assert list(symbols) == list(ref_symbols)
+        np.testing.assert_allclose(arr, ref_arr)
+        np.testing.assert_array_equal(fixed, ref_fixed)
+        center = find_central_atom(subcell, SIDE)
+        np.testing.assert_allclose(subcell.positions[center], SIDE / 2)
@@ -1,4 +1,4 @@
-from os import system
+from pathlib import Path
 from orchestrator.utils.input_output import ase_glob_read
 from orchestrator.storage import storage_builder
 from orchestrator.utils.data_standard import (
@@ -61,4 +61,4 @@ handle = storage.new_dataset(
 print(f'Added Ta configs as {handle} - remember to update the input '
       'files with the new handle!')
 
-system('rm orch.log')
+Path('orch.log').unlink(missing_ok=True)
@@ -1,26 +1,69 @@
 import os
 import glob
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
 from ase.io import read, write
 
 from orchestrator.utils.data_standard import ENERGY_KEY, FORCES_KEY, STRESS_KEY
 
+# below this many files, reading serially is faster than starting a pool
+PARALLEL_READ_THRESHOLD = 4
 
-def ase_glob_read(root_dir, file_ext='.xyz', file_format='extxyz'):
+
+def ase_glob_read(root_dir, file_ext='.xyz', file_format='extxyz',
+                  max_workers=1):
     """
     Reads all ASE atoms objects in `root_dir` with the matching` file_ext.
+
+    Files are read serially by default. Passing ``max_workers`` > 1 (or None)
+    parses them in parallel with a process pool when there are at least
+    PARALLEL_READ_THRESHOLD files. Pool workers may re-import the calling
+    script (always under the spawn and forkserver start methods), so only
+    opt in when the entry point is protected by an
+    ``if __name__ == '__main__':`` guard.
+
+    :param max_workers: maximum number of processes used to read the files.
+        Defaults to 1 (serial). None uses all CPUs available to the process.
+    :type max_workers: int
     """
 
     if file_ext[0] != '.':
         file_ext = '.' + file_ext
 
-    images = []
-    for f in sorted(glob.glob(os.path.join(root_dir, f'*{file_ext}'))):
-        images += safe_read(f, format=file_format)
+    files = sorted(glob.glob(os.path.join(root_dir, f'*{file_ext}')))
+    if max_workers is None:
+        max_workers = _available_cpus()
+    n_workers = min(max_workers, len(files))
+    if n_workers > 1 and len(files) >= PARALLEL_READ_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(_safe_read_one, files, repeat(file_format))
+            images = list(chain.from_iterable(results))
+    else:
+        images = []
+        for f in files:
+            images += _safe_read_one(f, file_format)
 
     return images
 
 
+def _available_cpus():
+    """
+    Number of CPUs this process may run on, respecting affinity restrictions
+    (e.g. from a scheduler) where the platform supports querying them
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _safe_read_one(path, file_format):
+    """
+    Module level wrapper of safe_read so that it can be used by a process pool
+    """
+    return safe_read(path, format=file_format)
+
+
 def try_loading_ase_keys(images):
     """
     Try to populate energy/forces/stress fields, in case they weren't
@@ -30,6 +73,10 @@ def try_loading_ase_keys(images):
         images = [images]
 
     for atoms in images:
+        # without a calculator every getter below would raise, so don't probe
+        if atoms.calc is None:
+            continue
+
         try:
             atoms.info[ENERGY_KEY] = atoms.get_potential_energy()
         except Exception:
@@ -90,10 +137,11 @@ def sort_configs_and_tag_atoms(list_of_atoms, id_key='co-id'):
 
     sorted_atoms = sorted(list_of_atoms, key=lambda atoms: atoms.info[id_key])
 
-    counter = 0
-    for atoms in sorted_atoms:
-        n = len(atoms)
-        atoms.arrays['atom_id'] = np.arange(counter, counter + n)
-        counter += n
+    lengths = np.fromiter((len(atoms) for atoms in sorted_atoms),
+                          dtype=np.int64,
+                          count=len(sorted_atoms))
+    starts = np.cumsum(lengths) - lengths
+    for atoms, start, n in zip(sorted_atoms, starts, lengths):
+        atoms.arrays['atom_id'] = np.arange(start, start + n)
 
     return sorted_atoms